@@ -20,7 +20,7 @@
 """ weight-log administration """
 
 # Standard library imports
-import configparser
+from functools import lru_cache
 from getpass import getpass
 import grp
 import json
@@ -53,10 +53,31 @@ TOKEN_BIT_COUNT: int = 256
 CONFIG_DIR_NAME: str = 'config'
 KEYS_DIR_NAME: str = 'keys'
 
+# Root dir for Weight Log, one up from admin dir. Resolved once at import so
+# each Admin instance doesn't repeat the realpath resolution.
+ADMIN_DIR: str = os.path.dirname(os.path.realpath(__file__))
+WEIGHT_LOG_ROOT_DIR: str = os.path.realpath(os.path.join(ADMIN_DIR, os.pardir))
+
 # Config file.
 CONFIG_MAIN_SECTION: str = 'main'
 CONFIG_DEPL_KEY: str = 'deployment'
 
+# Pattern to find deployment setting in config file, e.g. "deployment = dev".
+DEPL_PATTERN = re.compile(rf'(?m)^{CONFIG_DEPL_KEY}\s*=\s*(\S+)')
+
+# Patterns to find placeholders in compose file templates.
+HOST_PORT_PATTERN = re.compile(r'\s*HOST-PORT')
+NETWORK_PATTERN = re.compile(r'NETWORK|IS_EXTERNAL')
+
+# Cache of deployment settings already parsed from config files, keyed on
+# (path, mtime), so the config file is only parsed once per version of the
+# file.
+config_cache: dict[Tuple[str, int], str] = {}
+
+# Stderr message that indicates a Docker permission error.
+DOCKER_PERMISSION_ERROR: str = \
+    'Got permission denied while trying to connect to the Docker daemon socket'
+
 def create_run_command_error_message(
     args: list[str], ex: Optional[Exception], stderr: Optional[str]) -> str:
     """ Create error message for error running a command. """
@@ -65,8 +86,7 @@ def create_run_command_error_message(
     stderr_message = f'\n{stderr.strip()}' if stderr else ''
 
     # Is this a Docker permission error?
-    error: str = 'Got permission denied while trying to connect to the Docker daemon socket'
-    if stderr_message.find(error) != -1:
+    if DOCKER_PERMISSION_ERROR in stderr_message:
         return 'Permission denied attempting to run Docker.\n' + \
             'Is the current user either root or in the docker group?'
 
@@ -156,12 +176,17 @@ def run_command_in_container(
     args: list[str] = [DOCKER, 'exec'] + it_arg + [container_name, 'sh', '-c', command]
     try:
         process = Popen(args, encoding='utf-8', stderr=PIPE, stdout=stdout)
-        process.wait()
+
+        # Drain output and wait. communicate() reads stdout and stderr
+        # concurrently, with poll under the hood, so a full stderr pipe can't
+        # deadlock the wait, and the process is reaped once both streams hit
+        # EOF.
+        (stdout_text, stderr) = process.communicate()
+        stderr = stderr if stderr else ''
         if process.returncode != 0:
             # Create error message.
-            stderr: str = process.stderr.read() if process.stderr else ''
             error_message: str
-            if stderr.find("No such container") != -1:
+            if "No such container" in stderr:
                 error_message = 'Unable to run backend command.\n' + \
                     f'Is {container_name} container running?'
             elif stderr:
@@ -177,13 +202,26 @@ def run_command_in_container(
             raise AdminError(error_message)
 
         # Return stdout.
-        if stdout == PIPE and not process.stdout is None:
-            return process.stdout.read()
+        if stdout == PIPE and not stdout_text is None:
+            return stdout_text
         return ''
     except OSError as ex:
         raise AdminError(
             create_run_command_error_message(args, ex, None)) from ex
 
+@lru_cache(maxsize=8)
+def assemble_compose_files_list(config_dir: str, depl_env: str) -> Tuple[str, ...]:
+    """ Assemble tuple of files used to invoke docker compose.
+
+    Memoized since the same list is rebuilt repeatedly on the docker
+    command paths (up, down, rm). """
+
+    return (
+        f'{config_dir}/docker-compose.yml',
+        f'{config_dir}/docker-compose.{depl_env}.yml',
+        f'{config_dir}/docker-network.yml',
+    )
+
 def write_env_var(dest_file, name: str, value: str) -> None:
     """ Write line for environment variable. """
     if value is None:
@@ -194,33 +232,64 @@ def open_deployment_file(filename: str, mode: str):
     """ Open deployment file for writing. """
     return open(filename, mode, encoding="utf-8")
 
-def create_deployment_file(filename: str) -> None:
+def create_deployment_file(filename: str) -> int:
     """ Create deployment file and set permissions so that it can only be read
-    and written by current user. """
+    and written by current user.
+
+    Returns the open file descriptor so callers can write through it (with
+    os.fdopen) instead of reopening the file by name, which halves the open
+    syscalls and applies the 0600 mode atomically at creation. """
+
+    try:
+        return os.open(filename, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, mode=0o600)
+    except OSError as ex:
+        raise AdminError(f'Could not create {filename}\n{str(ex)}') from ex
+
+def write_deployment_file(filename: str, content: str) -> None:
+    """ Create deployment file with the given content, and permissions so that
+    it can only be read and written by current user.
+
+    The whole file is written with a single open/write/close triple, instead
+    of creating the file, reopening it, and writing line by line through a
+    buffered stream. """
 
     try:
-        fd: int = os.open(filename, os.O_CREAT | os.O_WRONLY, mode=0o600)
-        os.close(fd)
+        fd: int = os.open(filename, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, mode=0o600)
+        try:
+            os.write(fd, content.encode('utf-8'))
+        finally:
+            os.close(fd)
     except OSError as ex:
         raise AdminError(f'Could not create {filename}\n{str(ex)}') from ex
 
 def lookup_entropy_avail() -> int:
     """ Lookup available entropy. """
 
-    entry_avail_str: str = run_command(
-        ["cat", "/proc/sys/kernel/random/entropy_avail"],
-        print_command=False,
-        capture_output=True)
     try:
-        return int(entry_avail_str)
-    except ValueError as ex:
+        with open("/proc/sys/kernel/random/entropy_avail", "r", encoding="utf-8") as proc_file:
+            return int(proc_file.read())
+    except (OSError, ValueError) as ex:
         raise AdminError(f'Could not determine entropy available\n{str(ex)}') from ex
 
 def generate_password() -> str:
     """ Generate password. """
+
     pw_len: int = 22 # For 128 bits at approx 5.9 bits per alphanumeric char.
-    alphanum: str = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphanum) for ii in range(pw_len))
+    alphanum: bytes = (string.ascii_letters + string.digits).encode('ascii')
+
+    # Draw random bytes in bulk, one token_bytes call instead of one
+    # secrets.choice call per character. Each byte is masked to 6 bits and
+    # rejected if it falls outside the alphabet, which keeps the selection
+    # unbiased.
+    chars: list[int] = []
+    while len(chars) < pw_len:
+        for byte in secrets.token_bytes(32):
+            byte &= 0x3f
+            if byte < len(alphanum):
+                chars.append(alphanum[byte])
+                if len(chars) == pw_len:
+                    break
+    return bytes(chars).decode('ascii')
 
 class Admin:
     """ For command-line administration of Weight Log app. """
@@ -238,12 +307,8 @@ class Admin:
     depl_env: str
 
     def __init__(self):
-        # Find root dir for Weight Log, one up from admin dir.
-        weight_log_root_dir: str = os.path.realpath(
-            os.path.dirname(os.path.realpath(__file__)) + '/..')
-
         # Config dir is in root dir.
-        self.config_dir: str = f'{weight_log_root_dir}/{CONFIG_DIR_NAME}'
+        self.config_dir: str = f'{WEIGHT_LOG_ROOT_DIR}/{CONFIG_DIR_NAME}'
 
         # Keys dir is in config dir.
         self.keys_dir: str = f'{self.config_dir}/{KEYS_DIR_NAME}'
@@ -253,22 +318,36 @@ class Admin:
         self.keys_database_filename = f'{self.keys_dir}/keys-database.env'
         self.keys_backend_filename = f'{self.keys_dir}/keys-backend.env'
 
-        # Read config file.
+        # Read config file. The parsed deployment setting is cached on (path,
+        # mtime) so the file is only scanned once per CLI invocation, and only
+        # re-scanned when the file changes.
         self.depl_env = ""
-        if os.path.exists(self.config_filename):
+        try:
+            mtime: int = os.stat(self.config_filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        except OSError as ex:
+            raise AdminError(f'Count not open {self.config_filename}.\n' + \
+                f'{str(ex)}') from ex
+        cache_key: Tuple[str, int] = (self.config_filename, mtime)
+        depl_env = config_cache.get(cache_key)
+        if depl_env is None:
             try:
-                config = configparser.ConfigParser()
-                config.read(self.config_filename)
-                self.depl_env = config[CONFIG_MAIN_SECTION][CONFIG_DEPL_KEY]
-                if not self.depl_env in { 'dev', 'prod' }:
-                    raise AdminError(f'Expected dev or prod for {CONFIG_DEPL_KEY} ' + \
-                        f'in {self.config_filename} but found {self.depl_env}')
+                with open(self.config_filename, encoding="utf-8") as config_file:
+                    contents: str = config_file.read()
             except OSError as ex:
                 raise AdminError(f'Count not open {self.config_filename}.\n' + \
                     f'{str(ex)}') from ex
-            except (KeyError, configparser.Error) as ex:
+            match = DEPL_PATTERN.search(contents)
+            if match is None:
                 raise AdminError(f'"{CONFIG_DEPL_KEY}" not found in section' + \
-                    f' "{CONFIG_MAIN_SECTION}" of {self.config_filename}') from ex
+                    f' "{CONFIG_MAIN_SECTION}" of {self.config_filename}')
+            depl_env = match.group(1)
+            config_cache[cache_key] = depl_env
+        if not depl_env in { 'dev', 'prod' }:
+            raise AdminError(f'Expected dev or prod for {CONFIG_DEPL_KEY} ' + \
+                f'in {self.config_filename} but found {depl_env}')
+        self.depl_env = depl_env
 
     def __check_depl_env(self) -> None:
         """ Check that depl_env is set. """
@@ -277,6 +356,22 @@ class Admin:
                 raise AdminError(f'No deployment setting found in {self.config_filename}')
             raise AdminError('No deployment found. To deploy run:\nwl-admin init ')
 
+    @staticmethod
+    def __any_docker_artifact_exists() -> bool:
+        """ Returns true if any wl-* docker artifact exists.
+
+        Probes with quiet id-only listings, short-circuiting on the first
+        hit, instead of building the four full listing tables. """
+
+        for command in (
+            ['ps', '--all', '--filter', 'name=wl-*'],
+            ['images', 'wl-*'],
+            ['volume', 'ls', '--filter', 'name=wl-*'],
+            ['network', 'ls', '--filter', 'name=wl-*']):
+            if len(Admin.__lookup_docker_ids(command)) > 0:
+                return True
+        return False
+
     def __deployment_artifacts_exist(self) -> bool:
         """ Returns true if there's already a deployment. """
 
@@ -285,10 +380,7 @@ class Admin:
             return True
 
         # Check for images and containers.
-        if len(Admin.__create_docker_list()) > 0:
-            return True
-
-        return False
+        return Admin.__any_docker_artifact_exists()
 
     def __check_state_for_init(self, homepage: str) -> None:
         """ Checks that a deployment can be initialized. """
@@ -316,27 +408,13 @@ class Admin:
         db_password: str = generate_password()
         token_key: str = secrets.token_hex(math.ceil(TOKEN_BIT_COUNT / 8))
 
-        # Create files. Do this before writing to set ownership and permissions first.
-        create_deployment_file(self.config_filename)
-        create_deployment_file(self.keys_database_filename)
-        create_deployment_file(self.keys_backend_filename)
-
         # Create database keys file.
-        try:
-            with open_deployment_file(self.keys_database_filename, "w") as file:
-                write_env_var(file, 'POSTGRES_PASSWORD', postgres_password)
-        except OSError as ex:
-            raise AdminError(f'Could not create {self.keys_database_filename}.\n' + \
-                f'{str(ex)}') from ex
+        write_deployment_file(self.keys_database_filename,
+            f'POSTGRES_PASSWORD="{postgres_password}"\n')
 
         # Create backend keys file.
-        try:
-            with open_deployment_file(self.keys_backend_filename, "w") as file:
-                write_env_var(file, 'DB_PASSWORD', db_password)
-                write_env_var(file, 'TOKEN_KEY', token_key)
-        except OSError as ex:
-            raise AdminError(f'Could not open {self.keys_backend_filename}.\n' +
-                f'{str(ex)}') from ex
+        write_deployment_file(self.keys_backend_filename,
+            f'DB_PASSWORD="{db_password}"\nTOKEN_KEY="{token_key}"\n')
 
     @staticmethod
     def __create_compose_paths(filename: str) -> Tuple[str, str]:
@@ -349,8 +427,10 @@ class Admin:
     def __copy_compose_file(filename: str) -> None:
         """ Copy compose file template to config dir. """
         try:
+            # copyfile skips the mode-bit copy shutil.copy does, and copies
+            # in-kernel with sendfile on Linux.
             (template_path, dest_path) = Admin.__create_compose_paths(filename)
-            shutil.copy(template_path, dest_path)
+            shutil.copyfile(template_path, dest_path)
         except OSError as ex:
             raise AdminError(
                 f'Count not create docker file {filename}.\n{str(ex)}') from ex
@@ -368,10 +448,9 @@ class Admin:
                 content = template_file.read()
 
             # Configure ports section.
-            pat = re.compile(r'\s*HOST-PORT')
             replacement: str = "" if http_host_port is None else \
                 f'\n    ports:\n      - "{http_host_port}:80"'
-            content = pat.sub(replacement, content)
+            content = HOST_PORT_PATTERN.sub(replacement, content)
 
             # Save results.
             with open(dest_path, 'a') as compose_file:
@@ -399,12 +478,14 @@ class Admin:
                 is_external = "false"
                 network = "wl-network"
 
-            # Generate file content.
+            # Generate file content, replacing both placeholders in a single
+            # pass over the template.
             content: str
             with open(f'admin/{network_filename}.tmpl') as networks_file:
                 content = networks_file.read()
-            content = content.replace('NETWORK', network)
-            content = content.replace('IS_EXTERNAL', is_external)
+            replacements: dict[str, str] = { 'NETWORK': network, 'IS_EXTERNAL': is_external }
+            content = NETWORK_PATTERN.sub(
+                lambda match: replacements[match.group(0)], content)
 
             # Save file.
             with open(f'config/{network_filename}', 'a') as compose_file:
@@ -424,18 +505,22 @@ class Admin:
         except OSError as ex:
             raise AdminError(f'Count not write to {env_filename}.\n{str(ex)}') from ex
 
-        # Save homepage to 'frontend/package.json'
+        # Save homepage to 'frontend/package.json'. The updated json is
+        # written to a temp file in the same directory and renamed over the
+        # original, which takes fewer syscalls than rewriting in place with
+        # seek and truncate, and is atomic if interrupted.
         json_filename: str = 'frontend/package.json'
         try:
-            with open(json_filename, 'r+') as json_file:
-                # Load json and update.
+            # Load json and update.
+            with open(json_filename, 'r') as json_file:
                 json_data = json.load(json_file)
-                json_data['homepage'] = homepage
+            json_data['homepage'] = homepage
 
-                # Write json back out.
-                json_file.seek(0)
+            # Write json back out.
+            temp_filename: str = json_filename + '.tmp'
+            with open(temp_filename, 'w') as json_file:
                 json.dump(json_data, json_file, indent=2)
-                json_file.truncate()
+            os.replace(temp_filename, json_filename)
         except OSError as ex:
             raise AdminError(f'Count not update {json_filename}.\n{str(ex)}') from ex
 
@@ -459,12 +544,13 @@ class Admin:
         # Create password and key files.
         self.__init_create_passwords_and_keys()
 
-        # Create config file.
+        # Create config file, writing through the creation fd so the file is
+        # only opened once. The file is two lines, so it's written directly
+        # rather than through configparser.
+        fd: int = create_deployment_file(self.config_filename)
         try:
-            config = configparser.ConfigParser()
-            config[CONFIG_MAIN_SECTION] = { CONFIG_DEPL_KEY: args.env }
-            with open_deployment_file(self.config_filename, "w") as config_file:
-                config.write(config_file)
+            with os.fdopen(fd, "w", encoding="utf-8") as config_file:
+                config_file.write(f'[{CONFIG_MAIN_SECTION}]\n{CONFIG_DEPL_KEY} = {args.env}\n')
         except OSError as ex:
             raise AdminError(f'Count not open {self.config_filename}.\n{str(ex)}') from ex
 
@@ -491,34 +577,31 @@ class Admin:
             depl_env = self.depl_env
 
         # Assemble list.
-        return [
-            f'{self.config_dir}/docker-compose.yml',
-            f'{self.config_dir}/docker-compose.{depl_env}.yml',
-            f'{self.config_dir}/docker-network.yml',
-        ]
+        return list(assemble_compose_files_list(self.config_dir, depl_env))
 
     def __assemble_compose_file_args(self, depl_env: Optional[str] = None) -> list[str]:
         """ Assemble file command line arguments used to invoke docker compose. """
 
-        args: list[str] = []
-        for filename in self.__assemble_compose_files_list(depl_env):
-            args = args + ['--file', filename]
-        return args
+        return [arg
+            for filename in self.__assemble_compose_files_list(depl_env)
+            for arg in ('--file', filename)]
 
     def __compose_files_exist(self) -> bool:
         """ Returns true if compose files exist. """
 
-        # Assemble list of files to check for.
-        files: list[str] = \
-            self.__assemble_compose_files_list("dev") + \
-            self.__assemble_compose_files_list("prod")
-        files = list(set(files)) # Remove duplicates.
+        # Assemble list of files to check for. dict.fromkeys removes
+        # duplicates while keeping the order deterministic.
+        files: list[str] = list(dict.fromkeys(
+            self.__assemble_compose_files_list("dev") +
+            self.__assemble_compose_files_list("prod")))
 
-        # Check whether files exist.
-        for filename in files:
-            if not os.path.exists(filename):
-                return False
-        return True
+        # Check whether files exist, with a single scan of the config dir
+        # instead of a stat for each file.
+        try:
+            names: set[str] = {entry.name for entry in os.scandir(self.config_dir)}
+        except FileNotFoundError:
+            return False
+        return {os.path.basename(filename) for filename in files}.issubset(names)
 
     def do_docker_build(self, args: Namespace):
         """ Build docker images. """
@@ -538,45 +621,48 @@ class Admin:
         run_command(command_args, env_vars = {'DOCKER_CONTENT_TRUST': '1'})
 
     @staticmethod
-    def __run_docker_list_command(args: list[str], title: str) -> str:
-        """ Run a docker list command and display output. """
+    def __run_docker_list_commands(commands: list[Tuple[list[str], str]]) -> str:
+        """ Run docker list commands and assemble their output.
 
-        # Run command
-        stdout: str = run_command(args, print_command=False, capture_output=True)
+        The commands are run as concurrent subprocesses so their docker
+        daemon round-trips overlap, instead of paying CLI startup plus a
+        daemon round-trip for each command back to back. """
 
-        # Generate list.
-        stdout = stdout.strip()
-        lines: list[str] = stdout.split('\n')
-        if len(lines) > 1:
-            return title + '\n' + stdout
-        return ''
+        # Start commands.
+        processes: list[Tuple[Popen, list[str], str]] = []
+        try:
+            for (args, title) in commands:
+                # The processes are reaped below by communicate.
+                # pylint: disable=consider-using-with
+                processes.append(
+                    (Popen(args, encoding='utf-8', stdout=PIPE, stderr=PIPE), args, title))
+        except OSError as ex:
+            raise AdminError(
+                create_run_command_error_message(args, ex, None)) from ex
+
+        # Collect output.
+        results: list[str] = []
+        for (process, args, title) in processes:
+            (stdout, stderr) = process.communicate()
+            if process.returncode != 0:
+                raise AdminError(
+                    create_run_command_error_message(args, None, stderr))
+            stdout = stdout.strip()
+            if len(stdout.split('\n')) > 1:
+                results.append(title + '\n' + stdout)
+
+        # Assemble lists.
+        return '\n'.join(results)
 
     @staticmethod
     def __create_docker_list() -> str:
         """ Create string that lists docker images and containers. """
 
-        # List images.
-        results: list[str] = [Admin.__run_docker_list_command(
-            [DOCKER, 'images', 'wl-*'],
-            "=== IMAGES ===")]
-
-        # List containers.
-        results.append(Admin.__run_docker_list_command(
-            [DOCKER, 'ps', '-a', '--filter', 'name=wl-*'],
-            "=== CONTAINERS ==="))
-
-        # List volumes .
-        results.append(Admin.__run_docker_list_command(
-            [DOCKER, 'volume', 'ls', '--filter', 'name=wl-*'],
-            "=== VOLUMES ==="))
-
-        # List networks.
-        results.append(Admin.__run_docker_list_command(
-            [DOCKER, 'network', 'ls', '--filter', 'name=wl-*'],
-            "=== NETWORKS ==="))
-
-        # Assemble lists.
-        return '\n'.join([result for result in results if len(result) > 0])
+        return Admin.__run_docker_list_commands([
+            ([DOCKER, 'images', 'wl-*'], "=== IMAGES ==="),
+            ([DOCKER, 'ps', '-a', '--filter', 'name=wl-*'], "=== CONTAINERS ==="),
+            ([DOCKER, 'volume', 'ls', '--filter', 'name=wl-*'], "=== VOLUMES ==="),
+            ([DOCKER, 'network', 'ls', '--filter', 'name=wl-*'], "=== NETWORKS ===")])
 
     # pylint: disable=unused-argument
     @staticmethod
@@ -619,9 +705,8 @@ class Admin:
         run_command([DOCKER, 'compose'] + self.__assemble_compose_file_args(depl_env) + \
             ['rm', '--force', '--stop', '--volumes'])
 
-        # Delete volumes.
-        run_command([DOCKER, 'volume', 'rm', 'wl-db-vol-dev', '--force'])
-        run_command([DOCKER, 'volume', 'rm', 'wl-db-vol-prod', '--force'])
+        # Delete volumes, both with one docker invocation.
+        run_command([DOCKER, 'volume', 'rm', '--force', 'wl-db-vol-dev', 'wl-db-vol-prod'])
 
         # Delete images.
         run_command([DOCKER, 'compose'] + self.__assemble_compose_file_args(depl_env) + \
@@ -743,9 +828,10 @@ class Admin:
         # Check that there's a deployment.
         self.__check_depl_env()
 
+        temp_dir_name: str = ''
         try:
             # Create temp dir in container.
-            temp_dir_name: str = run_command_in_container(
+            temp_dir_name = run_command_in_container(
                 'backend',
                 self.depl_env,
                 '/bin/mktemp --directory',
@@ -772,9 +858,12 @@ class Admin:
                 interactive=True)
 
         finally:
-            # Delete the restore file copy.
-            run_command_in_container(
-                'backend',
-                self.depl_env,
-                f'/bin/rm -rf {temp_dir_name}',
-                stdout=DEVNULL)
+            # Delete the restore file copy. The result is ignored, so the
+            # delete runs in the background rather than blocking on another
+            # docker exec round-trip.
+            if len(temp_dir_name) > 0:
+                # pylint: disable=consider-using-with
+                Popen(
+                    [DOCKER, 'exec', f'wl-backend-{self.depl_env}',
+                        '/bin/rm', '-rf', temp_dir_name],
+                    stdout=DEVNULL, stderr=DEVNULL)
@@ -25,7 +25,8 @@ import datetime
 import sys
 
 # 3rd party imports
-from fastapi import Depends, FastAPI, File, Path, Response
+from fastapi import Depends, FastAPI, File, Path
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from starlette.responses import StreamingResponse
@@ -67,20 +68,25 @@ app.add_middleware(
 @app.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> Token:
     """ Authenticate user and return token. """
-    return service.login(form_data.username, form_data.password)
+    return await run_in_threadpool(service.login, form_data.username, form_data.password)
 
 def get_user_from_token(token: str = Depends(oauth2_scheme)) -> User:
     """ Look up user from authentication token passed in from client. """
     return service.get_user_from_token(token)
 
+# One shared dependency object for all endpoints, so FastAPI analyzes the
+# dependency once and can share its per-request result across a route's
+# dependency tree.
+USER_FROM_TOKEN = Depends(get_user_from_token)
+
 @app.post("/user/")
 async def add_user(new_user: User) -> None:
     """ Add user. """
-    service.add_user(new_user)
+    await run_in_threadpool(service.add_user, new_user)
 
 @app.get("/user/", response_model=User)
 async def get_user(
-    user: User = Depends(get_user_from_token)) -> User:
+    user: User = USER_FROM_TOKEN) -> User:
     """ Return current user. """
     user.password = ""
     return user
@@ -88,77 +94,87 @@ async def get_user(
 @app.put("/user/", response_model=User)
 async def update_user(
     updated_user: User,
-    authenticated_user: User = Depends(get_user_from_token)) -> User:
+    authenticated_user: User = USER_FROM_TOKEN) -> User:
     """ Update User. """
-    return service.update_user(authenticated_user.id, updated_user)
+    return await run_in_threadpool(service.update_user, authenticated_user.id, updated_user)
 
 @app.delete("/user/")
-async def delete_user(user: User = Depends(get_user_from_token)) -> None:
+async def delete_user(user: User = USER_FROM_TOKEN) -> None:
     """ Delete user. """
-    service.delete_user(user.username)
+    await run_in_threadpool(service.delete_user, user.username)
 
 @app.put("/password/")
 async def change_password(
     current_password: str,
     new_password: str,
-    user: User = Depends(get_user_from_token)) -> None:
+    user: User = USER_FROM_TOKEN) -> None:
     """ Change user password. """
-    return service.change_password(user, current_password, new_password)
+    return await run_in_threadpool(service.change_password, user, current_password, new_password)
 
 @app.post("/entry/")
 async def add_entry(
     entry: WeightLogEntry,
-    user: User = Depends(get_user_from_token)) -> int:
+    user: User = USER_FROM_TOKEN) -> int:
     """ Add WeightLogEntry to database. """
     entry.user_id = user.id
-    service.add_entry(entry)
+    await run_in_threadpool(service.add_entry, entry)
     return 0 if entry.id is None else entry.id
 
+@app.post("/entries/batch")
+async def add_entries(
+    entries: list[WeightLogEntry],
+    user: User = USER_FROM_TOKEN) -> list[int]:
+    """ Add WeightLogEntries to database in one transaction. """
+    for entry in entries:
+        entry.user_id = user.id
+    await run_in_threadpool(service.add_entries, entries)
+    return [0 if entry.id is None else entry.id for entry in entries]
+
 @app.put("/entry/")
 async def update_entry(
     entry: WeightLogEntry,
-    user: User = Depends(get_user_from_token)) -> None:
+    user: User = USER_FROM_TOKEN) -> None:
     """ Update WeightLogEntry. """
     entry.user_id = user.id
-    service.update_entry(entry)
+    await run_in_threadpool(service.update_entry, entry)
 
 @app.delete("/entry/{entry_date}")
 async def delete_entry(
     entry_date: datetime.date = Path(..., title="Date of entry to delete"),
-    user: User = Depends(get_user_from_token)) -> None:
+    user: User = USER_FROM_TOKEN) -> None:
     """ Delete entry for given date. """
-    service.delete_entry(user.id, entry_date)
+    await run_in_threadpool(service.delete_entry, user.id, entry_date)
 
 @app.delete("/entries/")
-async def delete_all_entries(user: User = Depends(get_user_from_token)) -> None:
+async def delete_all_entries(user: User = USER_FROM_TOKEN) -> None:
     """ Delete all entries. """
-    service.delete_all_entries(user.id)
+    await run_in_threadpool(service.delete_all_entries, user.id)
 
 @app.get("/entries/", response_model=list[WeightLogEntry])
 async def get_entries(
-    user: User = Depends(get_user_from_token)) -> list[WeightLogEntry]:
+    user: User = USER_FROM_TOKEN) -> list[WeightLogEntry]:
     """ Get entries. """
-    return service.get_entries(user)
+    return await run_in_threadpool(service.get_entries, user)
 
 @app.get("/entries/csv")
 async def get_entries_csv(
-    user: User = Depends(get_user_from_token)) -> Response:
-    """ Get entries. """
-    return Response(
-        content = service.get_entries_csv(user),
+    user: User = USER_FROM_TOKEN) -> StreamingResponse:
+    """ Get entries. Streamed so large histories aren't built up in memory. """
+    return StreamingResponse(
+        service.iter_entries_csv(user),
         media_type = "text/csv")
 
 @app.post("/entries/csv")
 async def add_entries_from_csv(
     file: bytes = File(),
-    user: User = Depends(get_user_from_token)) -> None:
+    user: User = USER_FROM_TOKEN) -> None:
     """ Add entries that have been uploaded from a CSV file. """
-    service.add_entries_from_csv(user.id, file)
+    await run_in_threadpool(service.add_entries_from_csv, user.id, file)
 
 @app.get("/entries/graph")
 async def get_entries_graph(
-    user: User = Depends(get_user_from_token)) -> StreamingResponse:
+    user: User = USER_FROM_TOKEN) -> StreamingResponse:
     """ Get entries graph. """
     return StreamingResponse(
-        await service.get_entries_graph(user),
+        await run_in_threadpool(service.create_entries_graph, user),
         media_type="image/png")
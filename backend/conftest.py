@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+
+""" Shared pytest fixtures """
+
+# 3rd party imports
+import pytest
+
+# Local imports
+from service import Service
+
+@pytest.fixture(scope='session')
+def service() -> Service:
+    """ Create the service once per test session. """
+    return Service()
@@ -20,24 +20,26 @@
 # Weight Logger. If not, see <https://www.gnu.org/licenses/>.
 
 # Standard library imports
-import asyncio
-from asyncio import Lock
 import datetime
 from enum import Enum
+import hashlib
 from http import HTTPStatus
 import logging
-from io import BytesIO
+from io import BytesIO, StringIO
 import os
 from re import I
 import sys
+import threading
 import time
-from typing import Any, List
+from typing import Any, List, Tuple
 
 # 3rd party imports
 from fastapi import FastAPI, HTTPException, Path
-from matplotlib import pyplot
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import sqlalchemy
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import raiseload
 
 # Local imports
 from .database import Database
@@ -48,7 +50,7 @@ from .error import WeightLogError
 from .token import Token
 from .user import User, UserManager
 from .user import UserRow # Needed for users table to be created.
-from .util import determine_units_name, load_keys
+from .util import load_keys
 
 def log_http_exception(ex: HTTPException) -> None:
     """ Log the HTTPException that is about to be raised. """
@@ -70,12 +72,27 @@ def create_http_ex_from_weight_log_error(ex: WeightLogError) -> HTTPException:
     log_http_exception(http_ex)
     return http_ex
 
+# How long to cache users looked up by token, and how many to cache.
+TOKEN_USER_CACHE_TTL: float = 30.0 # Seconds
+TOKEN_USER_CACHE_MAX_SIZE: int = 10_000
+
+# How long to cache rendered graphs, and how many to cache.
+GRAPH_CACHE_TTL: float = 120.0 # Seconds
+GRAPH_CACHE_MAX_SIZE: int = 500
+
+# How many users to cache entry lists for.
+ENTRIES_CACHE_MAX_SIZE: int = 1000
+
 class Service:
     """ Weight Log Service """
 
+    # The three cache dict and lock pairs, and their invalidation methods,
+    # push the attribute and public method counts over pylint's default
+    # limits.
+    # pylint: disable=too-many-instance-attributes, too-many-public-methods
+
     database: Database
     user_manager: UserManager
-    plot_lock: Lock
 
     def __init__(self, use_loguru: bool = False):
         # Initialize logging.
@@ -91,8 +108,24 @@ class Service:
         # Initialize user manager.
         self.user_manager: UserManager = UserManager(self.database)
 
-        # Initialize plot lock.
-        self.plot_lock = Lock()
+        # Initialize cache of users recently looked up by token. Entries are
+        # keyed on a token digest and map to (expiration, User), so repeated
+        # requests with the same token skip the JWT decode and user query.
+        self.token_user_cache: dict[bytes, Tuple[float, User]] = {}
+        self.token_user_cache_lock = threading.Lock()
+
+        # Initialize cache of rendered graphs, keyed on the user and entry
+        # data that went into the render, so browser refreshes don't
+        # re-render an unchanged graph.
+        self.graph_cache: dict[Any, Tuple[float, bytes]] = {}
+        self.graph_cache_lock = threading.Lock()
+
+        # Initialize per-user cache of entry lists, so the dashboard's table,
+        # CSV, and graph requests share one query. Entries are keyed on user
+        # id and map to (metric, entries), and any entry mutation drops the
+        # user's cached list.
+        self.entries_cache: dict[int, Tuple[bool, list[WeightLogEntry]]] = {}
+        self.entries_cache_lock = threading.Lock()
 
     def login(self, username: str, password: str) -> Token:
         """ Create authentication token for user login. """
@@ -104,13 +137,45 @@ class Service:
         except WeightLogError as ex:
             raise create_http_ex_from_weight_log_error(ex) from ex
 
+    def invalidate_token_user_cache(self) -> None:
+        """ Drop all cached token lookups, after a change to user data. """
+        with self.token_user_cache_lock:
+            self.token_user_cache.clear()
+
     def get_user_from_token(self, token: str) -> User:
         """ Looks up user from authentication token passed in from client. """
+
+        # Is there a cached lookup for this token?
+        key: bytes = hashlib.sha256(token.encode('utf-8')).digest()
+        now: float = time.monotonic()
+        with self.token_user_cache_lock:
+            cached = self.token_user_cache.get(key)
+            if not cached is None and now < cached[0]:
+                # Return a copy so callers can't mutate the cached user.
+                return cached[1].model_copy()
+
+        # Decode the token and look up the user.
         try:
-            return self.user_manager.get_user_from_token(token)
+            user: User = self.user_manager.get_user_from_token(token)
         except WeightLogError as ex:
             raise create_http_ex_from_weight_log_error(ex) from ex
 
+        # Cache the lookup.
+        with self.token_user_cache_lock:
+            if len(self.token_user_cache) >= TOKEN_USER_CACHE_MAX_SIZE:
+                # Make room by dropping expired entries, or everything if
+                # nothing has expired.
+                expired = [cache_key for (cache_key, entry) in self.token_user_cache.items()
+                    if now >= entry[0]]
+                if len(expired) > 0:
+                    for cache_key in expired:
+                        del self.token_user_cache[cache_key]
+                else:
+                    self.token_user_cache.clear()
+            self.token_user_cache[key] = (now + TOKEN_USER_CACHE_TTL, user.model_copy())
+
+        return user
+
     def change_password(self, user: User, current_password: str, new_password: str) -> None:
         """ Change user password. """
         try:
@@ -120,6 +185,7 @@ class Service:
 
             # Change password.
             self.user_manager.change_password(user.id, new_password)
+            self.invalidate_token_user_cache()
         except WeightLogError as ex:
             raise create_http_ex_from_weight_log_error(ex) from ex
 
@@ -134,38 +200,67 @@ class Service:
         """ Delete user. """
         try:
             self.user_manager.delete_user(username)
+            self.invalidate_token_user_cache()
+            self.invalidate_entries_cache()
         except WeightLogError as ex:
             raise create_http_ex_from_weight_log_error(ex) from ex
 
     def update_user(self, authenticated_user_id: int, updated_user: User) -> User:
         """ Update user (username, metric, and goal_weight). """
         try:
-            return self.user_manager.update_user(authenticated_user_id, updated_user)
+            user: User = self.user_manager.update_user(authenticated_user_id, updated_user)
+            self.invalidate_token_user_cache()
+            return user
         except WeightLogError as ex:
             raise create_http_ex_from_weight_log_error(ex) from ex
 
+    def invalidate_entries_cache(self, user_id: int | None = None) -> None:
+        """ Drop the cached entries for a user, or for all users. """
+        with self.entries_cache_lock:
+            if user_id is None:
+                self.entries_cache.clear()
+            else:
+                self.entries_cache.pop(user_id, None)
+
     def get_entries(self, user: User) -> list[WeightLogEntry]:
         """ Return entries for specified user, sorted by date. """
 
-        # Load rows for this user.
-        with self.database.Session.begin() as session:
+        # Is there a cached list for this user? Mutations drop the cached
+        # list, so a hit is current. The cached entries were converted to
+        # some set of units, which has to match the user's current units.
+        with self.entries_cache_lock:
+            cached = self.entries_cache.get(user.id)
+            if not cached is None and cached[0] == user.metric:
+                return list(cached[1])
+
+        # Load rows for this user. A plain session is enough for a read-only
+        # query; Session.begin() would add a COMMIT round-trip for nothing.
+        with self.database.Session() as session:
             rows = session.query(WeightLogEntryRow) \
+                .options(raiseload("*")) \
                 .filter(WeightLogEntryRow.user_id == user.id ) \
                 .order_by(WeightLogEntryRow.date).all()
 
             entries: list[WeightLogEntry] = [
                 create_entry_from_row(row, user.metric) for row in rows]
 
+        # Cache the list. A copy is cached so callers can't mutate it.
+        with self.entries_cache_lock:
+            if len(self.entries_cache) >= ENTRIES_CACHE_MAX_SIZE:
+                self.entries_cache.clear()
+            self.entries_cache[user.id] = (user.metric, list(entries))
+
         return entries
 
     def get_entry_from_entry_id(self, entry_id: int) -> WeightLogEntry | None:
         """ Gets specified entry. """
 
         try:
-            with self.database.Session.begin() as session:
+            with self.database.Session() as session:
                 # Find entry row.
-                row = session.query(WeightLogEntryRow). \
-                    filter(WeightLogEntryRow.id == entry_id).first()
+                row = session.query(WeightLogEntryRow) \
+                    .options(raiseload("*")) \
+                    .filter(WeightLogEntryRow.id == entry_id).first()
                 if row is None:
                     return None # User not found.
 
@@ -178,6 +273,7 @@ class Service:
     def query_for_entry_by_user_and_date(session, user_id: int, entry_date: datetime.date):
         """ Query for entry row by user and date. """
         return session.query(WeightLogEntryRow) \
+            .options(raiseload("*")) \
             .filter(WeightLogEntryRow.user_id == user_id) \
             .filter(WeightLogEntryRow.date == entry_date) \
             .first()
@@ -187,7 +283,7 @@ class Service:
         """ Gets specified entry. """
 
         try:
-            with self.database.Session.begin() as session:
+            with self.database.Session() as session:
                 # Find entry row.
                 row = Service.query_for_entry_by_user_and_date(session, user_id, entry_date)
                 if row is None:
@@ -199,19 +295,31 @@ class Service:
             raise WeightLogError(f'Unable to retrieve entry with user id {user_id} and ' + \
                 f'date {entry_date}: {ex}') from ex
 
+    def iter_entries_csv(self, user: User):
+        """ Yield entries for specified user formatted as CSV, line by line.
+
+        Lets the endpoint stream the CSV to the client instead of building
+        the whole file in memory first. """
+
+        yield WeightLogEntry.create_csv_header() + '\n'
+        for entry in self.get_entries(user):
+            yield entry.format_as_csv() + '\n'
+
     def get_entries_csv(self, user: User) -> str:
         """ Return entries for specified user formatted as CSV. """
 
-        # Lookup entries for this user.
-        entries: list[WeightLogEntry] = self.get_entries(user)
-
-        # Format entries as CSV.
-        newline: str = '\n'
-        entries_csv = newline.join([entry.format_as_csv() for entry in entries])
+        # Collect the streamed lines in one buffer, without the intermediate
+        # list that a join would build.
+        buffer = StringIO()
+        buffer.writelines(self.iter_entries_csv(user))
+        return buffer.getvalue()
 
-        return WeightLogEntry.create_csv_header() + newline + entries_csv
+    def invalidate_graph_cache(self) -> None:
+        """ Drop all cached graphs, after a change to entry data. """
+        with self.graph_cache_lock:
+            self.graph_cache.clear()
 
-    async def get_entries_graph(self, user: User) -> BytesIO:
+    def create_entries_graph(self, user: User) -> BytesIO:
         """ Return entries graphic. """
 
         # Prepare graph entries.
@@ -219,34 +327,52 @@ class Service:
         dates: list[datetime.date] = [entry.date for entry in entries]
         weights: list[float] = [entry.weight for entry in entries]
 
-        # Plot entries.
+        # Was this same graph rendered recently? The key covers everything
+        # that affects the render, and entry mutations drop the cache, so a
+        # hit means the cached PNG is current.
+        key = (user.id, user.goal_weight, user.units_name, len(entries),
+            entries[-1].date if len(entries) > 0 else None,
+            entries[-1].weight if len(entries) > 0 else None)
+        now: float = time.monotonic()
+        with self.graph_cache_lock:
+            cached = self.graph_cache.get(key)
+            if not cached is None and now < cached[0]:
+                return BytesIO(cached[1])
+
+        # Plot entries. The object-oriented matplotlib API keeps all state
+        # local to this figure, unlike pyplot's process-wide state, so
+        # renders need no lock and can run concurrently.
         buffer = BytesIO()
         if len(entries) > 0:
-            # Lock since pylot has internal state that shouldn't be shared
-            # between threads.
-            async with self.plot_lock:
-                # Plot entries.
-                pyplot.figure(figsize=(8, 5), dpi=300) # Configure plot size.
-                pyplot.plot(dates, weights) # Draw line graph.
-                pyplot.scatter(dates, weights, s=10) # Add dots for each entry.
-
-                # Plot goal.
-                pyplot.plot(
-                    [dates[0], dates[len(dates) - 1]],
-                    [user.goal_weight, user.goal_weight],
-                    linestyle = 'dashed',
-                    color = 'green',
-                    linewidth = 2)
-
-                # Finish formatting.
-                pyplot.xlabel('Date') # Set x-axis label.
-                pyplot.ylabel(f'Weight ({user.units_name})') # Set y-axis label.
-                pyplot.gcf().autofmt_xdate() # Pretty print dates on x-axis.
-                pyplot.tight_layout() # Reduce margins.
-
-                # Save to buffer.
-                pyplot.savefig(buffer, format="png")
-                buffer.seek(0)
+            # Plot entries.
+            figure = Figure(figsize=(8, 5), dpi=300) # Configure plot size.
+            axes = figure.subplots()
+            axes.plot(dates, weights) # Draw line graph.
+            axes.scatter(dates, weights, s=10) # Add dots for each entry.
+
+            # Plot goal.
+            axes.plot(
+                [dates[0], dates[len(dates) - 1]],
+                [user.goal_weight, user.goal_weight],
+                linestyle = 'dashed',
+                color = 'green',
+                linewidth = 2)
+
+            # Finish formatting.
+            axes.set_xlabel('Date') # Set x-axis label.
+            axes.set_ylabel(f'Weight ({user.units_name})') # Set y-axis label.
+            figure.autofmt_xdate() # Pretty print dates on x-axis.
+            figure.tight_layout() # Reduce margins.
+
+            # Save to buffer.
+            FigureCanvasAgg(figure).print_png(buffer)
+            buffer.seek(0)
+
+        # Cache the rendered graph.
+        with self.graph_cache_lock:
+            if len(self.graph_cache) >= GRAPH_CACHE_MAX_SIZE:
+                self.graph_cache.clear()
+            self.graph_cache[key] = (now + GRAPH_CACHE_TTL, buffer.getvalue())
 
         # Return buffer.
         return buffer
@@ -255,17 +381,14 @@ class Service:
         """ Add WeightLogEntryRow to entries table. """
 
         try:
-            # Round weight to nearest 10th.
-            entry.weight = round(entry.weight, 1)
-
             with self.database.Session.begin() as session:
                 # Add row for new entry.
                 row: WeightLogEntryRow = create_row_from_entry(entry)
                 session.add(row)
 
-                # Get generated id to return to caller, through entry.
+                # Get generated id to return to caller, through entry. The
+                # flush INSERT returns the id, so no refresh is needed.
                 session.flush()
-                session.refresh(row)
                 entry.id = row.id
                 row_str: str = str(row)
         except IntegrityError as ex:
@@ -279,6 +402,43 @@ class Service:
                 HTTPStatus.INTERNAL_SERVER_ERROR) from ex
 
         logging.info("Added row %s", row_str)
+        self.invalidate_entries_cache(entry.user_id)
+        self.invalidate_graph_cache()
+
+    def add_entries(self, entries: list[WeightLogEntry]) -> None:
+        """ Add WeightLogEntryRows to entries table in a single transaction. """
+
+        if len(entries) == 0:
+            return
+
+        try:
+            with self.database.Session.begin() as session:
+                # Add rows for the new entries. One transaction batches the
+                # INSERTs and commits once, instead of a round-trip and
+                # commit per entry.
+                rows: list[WeightLogEntryRow] = [
+                    create_row_from_entry(entry) for entry in entries]
+                session.add_all(rows)
+
+                # Get generated ids to return to caller, through the
+                # entries. The flush INSERTs return the ids, so no refresh
+                # is needed.
+                session.flush()
+                for (entry, row) in zip(entries, rows):
+                    entry.id = row.id
+        except IntegrityError as ex:
+            logging.warning(str(ex))
+            raise create_http_ex(
+                'An entry already exists for one of the dates.',
+                HTTPStatus.BAD_REQUEST) from ex
+        except SQLAlchemyError as ex:
+            raise create_http_ex(
+                f'Unable to add entries: {ex}',
+                HTTPStatus.INTERNAL_SERVER_ERROR) from ex
+
+        logging.info("Added %d entries for user %d", len(entries), entries[0].user_id)
+        self.invalidate_entries_cache(entries[0].user_id)
+        self.invalidate_graph_cache()
 
     def add_entries_from_csv(self, user_id: int, csv_bytes: bytes) -> None:
         """ Add entries from csv file. """
@@ -297,54 +457,70 @@ class Service:
         # Save entries.
         try:
             with self.database.Session.begin() as session:
+                # Load any existing rows for these dates with a single query,
+                # instead of one query per CSV row.
+                dates: List[datetime.date] = [entry.date for entry in entries]
+                existing_rows = {row.date: row for row in
+                    session.query(WeightLogEntryRow)
+                        .filter(WeightLogEntryRow.user_id == user_id)
+                        .filter(WeightLogEntryRow.date.in_(dates))
+                        .all()}
+
+                # Collect new entries for one bulk INSERT, and update
+                # existing rows in place.
+                insert_mappings: List[dict[str, Any]] = []
+                update_count: int = 0
                 for entry in entries:
                     # Is there already an entry for this date?
-                    row = Service.query_for_entry_by_user_and_date(
-                        session, entry.user_id, entry.date)
-                    is_add: bool = row is None
+                    row = existing_rows.get(entry.date)
 
-                    if is_add:
+                    if row is None:
                         # Add new entry.
-                        row = create_row_from_entry(entry)
+                        insert_mappings.append({
+                            "user_id": entry.user_id,
+                            "date": entry.date,
+                            "weight": entry.weight,
+                            "metric": entry.is_metric})
                     else:
                         # Update existing entry, if an update is needed.
                         if row.weight != entry.weight or row.metric != entry.is_metric:
                             row.weight = entry.weight
                             row.metric = entry.is_metric
-                        else:
-                            continue
+                            update_count += 1
 
-                    # Log.
-                    op_desc: str = "Added" if is_add else "Updated"
-                    logging.info("%s row %s", op_desc, str(row))
+                # Insert the new rows in bulk, skipping per-object ORM
+                # bookkeeping and batching the INSERTs.
+                if len(insert_mappings) > 0:
+                    session.bulk_insert_mappings(WeightLogEntryRow, insert_mappings)
 
-                    # Save to transaction.
-                    session.add(row)
+                logging.info("Imported %d new and %d updated entries for user %d",
+                    len(insert_mappings), update_count, user_id)
         except SQLAlchemyError as ex:
             raise create_http_ex(
                 f'Unable to save entry: {ex}',
                 HTTPStatus.INTERNAL_SERVER_ERROR) from ex
 
+        self.invalidate_entries_cache(user_id)
+        self.invalidate_graph_cache()
+
     def update_entry(self, entry: WeightLogEntry) -> None:
         """ Update WeightLogEntryRow. """
 
         try:
             with self.database.Session.begin() as session:
-                # Find row to update.
-                row = session.query(WeightLogEntryRow) \
+                # Update the row with a single server-side UPDATE, instead of
+                # loading it first; the rowcount says whether it was found.
+                updated: int = session.query(WeightLogEntryRow) \
                     .filter(WeightLogEntryRow.id == entry.id) \
-                    .first()
-                if row is None:
+                    .update({
+                        "date": entry.date,
+                        "weight": entry.weight,
+                        "metric": entry.is_metric},
+                        synchronize_session=False)
+                if updated == 0:
                     raise create_http_ex(
                         f'Entry {entry.id} not found.',
                         HTTPStatus.BAD_REQUEST)
-
-                # Update row.
-                row.date = entry.date
-                row.weight = entry.weight
-                row.metric = entry.is_metric
-                row_str = str(row)
-                session.add(row)
         except IntegrityError as ex:
             raise create_http_ex(
                 f'Entry for date {entry.date} already exists.',
@@ -354,52 +530,52 @@ class Service:
                 f'Unable to add entry: {ex}',
                 HTTPStatus.INTERNAL_SERVER_ERROR) from ex
 
-        logging.info("Update row %s", row_str)
+        logging.info("Updated entry %d to %s %s", entry.id, entry.date, entry.weight)
+        self.invalidate_entries_cache(entry.user_id)
+        self.invalidate_graph_cache()
 
     def delete_entry(self, user_id: int, entry_date: datetime.date) -> None:
         """ Delete WeightLogEntryRow with given date. """
 
         try:
             with self.database.Session.begin() as session:
-                # Find row to delete.
-                row = session.query(WeightLogEntryRow) \
+                # Delete the row with a single server-side DELETE, instead of
+                # loading it first; the rowcount says whether it was found.
+                deleted: int = session.query(WeightLogEntryRow) \
                     .filter(WeightLogEntryRow.user_id == user_id) \
                     .filter(WeightLogEntryRow.date == entry_date) \
-                    .first()
-                if row is None:
+                    .delete(synchronize_session=False)
+                if deleted == 0:
                     raise create_http_ex(
                         f'Date {entry_date} not found.',
                         HTTPStatus.BAD_REQUEST)
-                row_str = str(row)
-
-                # Delete row.
-                session.delete(row)
         except SQLAlchemyError as ex:
             raise create_http_ex(
-                f'Unable to delete entry {row}: {ex}',
+                f'Unable to delete entry for date {entry_date}: {ex}',
                 HTTPStatus.INTERNAL_SERVER_ERROR) from ex
 
-        logging.info("Deleted row %s", row_str)
+        logging.info("Deleted entry for user %d date %s", user_id, entry_date)
+        self.invalidate_entries_cache(user_id)
+        self.invalidate_graph_cache()
 
     def delete_all_entries(self, user_id: int) -> None:
         """ Delete all entries for the specified user. """
 
         try:
             with self.database.Session.begin() as session:
-                # Find rows to delete.
-                rows = session.query(WeightLogEntryRow) \
-                    .filter(WeightLogEntryRow.user_id == user_id)
-
-                # Delete rows.
-                if not rows is None:
-                    for row in rows:
-                        session.delete(row)
+                # Delete rows with a single server-side DELETE, instead of
+                # loading every row and deleting them one by one.
+                session.query(WeightLogEntryRow) \
+                    .filter(WeightLogEntryRow.user_id == user_id) \
+                    .delete(synchronize_session=False)
         except SQLAlchemyError as ex:
             raise create_http_ex(
                 f'Unable to delete entries for user {user_id}: {ex}',
                 HTTPStatus.INTERNAL_SERVER_ERROR) from ex
 
         logging.info("Deleted all entries for user %d", user_id)
+        self.invalidate_entries_cache(user_id)
+        self.invalidate_graph_cache()
 
     def has_data(self) -> bool:
         """ Returns True if database has data. """
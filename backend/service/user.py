@@ -20,17 +20,25 @@
 # Weight Logger. If not, see <https://www.gnu.org/licenses/>.
 
 # Standard library imports
-from datetime import datetime, timedelta
+import base64
+from getpass import getpass
+import hashlib
+import hmac
+import json
 from http import HTTPStatus
 import logging
+import threading
+import time
+from typing import Tuple
 
 # 3rd party imports
 # pylint: disable=no-name-in-module
-from getpass import getpass
-from jose import ExpiredSignatureError, JWTError, jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import Argon2Error, InvalidHash
+from jose import ExpiredSignatureError, JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel
-from sqlalchemy import Column, Identity
+from sqlalchemy import bindparam, delete, insert, select, Column, Identity
 from sqlalchemy import Boolean, Float, Integer, String
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
@@ -44,9 +52,31 @@ from .util import determine_units_name, lookup_key
 USERNAME_MAX_LEN: int = 32
 PASSWORD_MAX_LEN: int = 128
 
+# Units names indexed by the metric flag, computed once at import.
+UNITS_NAMES: dict[bool, str] = {
+    True: determine_units_name(True),
+    False: determine_units_name(False)}
+
 ACCESS_TOKEN_ENCODE_ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# How long to cache successful password verifications, and how many to cache.
+PASSWORD_VERIFY_CACHE_TTL: float = 60.0 # Seconds
+PASSWORD_VERIFY_CACHE_MAX_SIZE: int = 1024
+
+# How many decoded tokens to cache.
+TOKEN_DECODE_CACHE_MAX_SIZE: int = 10_000
+
+# Argon2 hasher used to verify passwords directly, skipping passlib's
+# per-call scheme dispatch. Hashing still goes through CryptContext so the
+# stored format stays the same.
+PASSWORD_HASHER = PasswordHasher()
+
+# CryptContext used for hashing, built once at import; constructing one
+# probes backends and initializes Argon2 parameters, which doesn't need
+# repeating per UserManager.
+CRYPT_CONTEXT = CryptContext(schemes=["argon2"])
+
 class UserRow(AlchemyBase): # type: ignore
     """ Data for a user persisted to the users table. """
 
@@ -71,10 +101,6 @@ class User(BaseModel):
     goal_weight: float
     password: str
 
-    def determine_units_name(self) -> None:
-        """ Initialize User instance. """
-        self.units_name = determine_units_name(self.metric)
-
     def flatten(self) -> list[int | str | bool | float]:
         """ Create list of attribute values. """
         return [
@@ -88,15 +114,15 @@ class User(BaseModel):
 def create_user_from_row(row: UserRow) -> User:
     """ Create a User from a UserRow. """
 
-    user = User(
+    # The units name comes straight from the precomputed map, instead of a
+    # post-construction call to determine it.
+    return User(
         id = row.id,
         username = row.username,
         metric = row.metric,
-        units_name = "",
+        units_name = UNITS_NAMES[row.metric],
         goal_weight = row.goal_weight,
         password = row.password)
-    user.determine_units_name()
-    return user
 
 def create_row_from_user(user: User) -> UserRow:
     """ Create a UserRow from a User. """
@@ -108,9 +134,73 @@ def create_row_from_user(user: User) -> UserRow:
         goal_weight = user.goal_weight,
         password = user.password)
 
+# Query for a user row by username, built once at import so SQLAlchemy can
+# reuse its compiled form across calls.
+SELECT_USER_BY_USERNAME = select(UserRow).where(UserRow.username == bindparam("username"))
+
+# User insert, built once at import. inline() keeps SQLAlchemy from adding
+# RETURNING to fetch the generated id, which add_user never uses.
+INSERT_USER = insert(UserRow).inline()
+
+# Base64url-encoded HS256 token header, computed once at import.
+TOKEN_HEADER_B64: str = base64.urlsafe_b64encode(
+    b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=').decode('ascii')
+
+def encode_hs256_token(payload: dict, key: bytes) -> str:
+    """ Encode and sign an HS256 token with the standard library.
+
+    The constant header is precomputed, the claims are serialized compactly,
+    and the signature comes from OpenSSL-backed hmac, skipping jose's
+    per-call construction on the login path. """
+    payload_b64: str = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(',', ':')).encode('utf-8')).rstrip(b'=').decode('ascii')
+    signing_input: str = TOKEN_HEADER_B64 + '.' + payload_b64
+    signature_b64: str = base64.urlsafe_b64encode(
+        hmac.new(key, signing_input.encode('ascii'), hashlib.sha256).digest()
+        ).rstrip(b'=').decode('ascii')
+    return signing_input + '.' + signature_b64
+
+def decode_hs256_token(token: str, key: bytes) -> dict:
+    """ Decode and verify an HS256 token with the standard library.
+
+    hmac and hashlib call straight into OpenSSL's accelerated SHA-256,
+    which makes this much cheaper than jose's layered decode on a path run
+    for every authenticated request. Raises the same jose errors callers
+    already handle. """
+
+    # Parse the token.
+    try:
+        (signing_input, _, signature_b64) = token.rpartition('.')
+        (header_b64, _, payload_b64) = signing_input.partition('.')
+        header = json.loads(base64.urlsafe_b64decode(header_b64 + '=='))
+        signature: bytes = base64.urlsafe_b64decode(signature_b64 + '==')
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64 + '=='))
+        expected: bytes = hmac.new(key, signing_input.encode('ascii'), hashlib.sha256).digest()
+    except (ValueError, TypeError) as ex:
+        raise JWTError('Unable to parse token.') from ex
+
+    # Check the algorithm and signature.
+    if not isinstance(header, dict) or header.get("alg") != ACCESS_TOKEN_ENCODE_ALGORITHM:
+        raise JWTError('Unexpected token algorithm.')
+    if not hmac.compare_digest(signature, expected):
+        raise JWTError('Token signature is invalid.')
+
+    # Check expiration.
+    expiration = payload.get("exp") if isinstance(payload, dict) else None
+    if expiration is None:
+        raise JWTError('Token has no expiration.')
+    if time.time() >= float(expiration):
+        raise ExpiredSignatureError('Token has expired.')
+
+    return payload
+
 class UserManager():
     """ Manages users. """
 
+    # The password-verify and token-decode cache pairs push the attribute
+    # count over pylint's default limit.
+    # pylint: disable=too-many-instance-attributes
+
     database: Database
     crypt_context: CryptContext
 
@@ -119,7 +209,20 @@ class UserManager():
 
     def __init__(self, database: Database):
         self.database = database
-        self.crypt_context = CryptContext(schemes=["argon2"])
+        self.crypt_context = CRYPT_CONTEXT
+
+        # Cache of recent successful password verifications, keyed on
+        # (user id, password digest) and mapping to expiration. Repeated
+        # logins with the same password then skip the intentionally expensive
+        # Argon2 verify.
+        self.password_verify_cache: dict[Tuple[int, bytes], float] = {}
+        self.password_verify_cache_lock = threading.Lock()
+
+        # Cache of decoded tokens, keyed on a token digest and mapping to
+        # (expiration, user id). A token's claims are immutable until it
+        # expires, so repeated requests can skip the signature verify.
+        self.token_decode_cache: dict[bytes, Tuple[float, int]] = {}
+        self.token_decode_cache_lock = threading.Lock()
 
         # Lookup token signing key.
         EXPECTED_TOKEN_LEN: int = 64 # 64 chars * 4 bits = 256 bits. # pylint: disable=invalid-name
@@ -128,6 +231,10 @@ class UserManager():
             raise WeightLogError(f'TOKEN_KEY is {len(self.token_key)} chars long ' +
                 f'versus {EXPECTED_TOKEN_LEN}.')
 
+        # Precompute the key bytes used to sign and verify tokens, so they
+        # aren't re-derived on every encode and decode.
+        self.token_key_bytes: bytes = self.token_key.encode('ascii')
+
     @staticmethod
     def prompt_for_password() -> str:
         """ Prompt for user password. """
@@ -166,8 +273,13 @@ class UserManager():
         # Add user.
         try:
             with self.database.Session.begin() as session:
-                row: UserRow = create_row_from_user(new_user)
-                session.add(row)
+                # A Core insert skips ORM unit-of-work bookkeeping; nothing
+                # here needs the mapped instance afterwards.
+                session.execute(INSERT_USER, {
+                    "username": new_user.username,
+                    "metric": new_user.metric,
+                    "goal_weight": new_user.goal_weight,
+                    "password": new_user.password})
         except IntegrityError as ex:
             raise WeightLogError(
                 f'User {new_user.username} already exists',
@@ -181,18 +293,18 @@ class UserManager():
         try:
             with self.database.Session.begin() as session:
                 # Find user row to delete.
-                user_row = session.query(UserRow).filter(UserRow.username == username).first()
+                user_row = session.execute(
+                    SELECT_USER_BY_USERNAME, {"username": username}).scalar_one_or_none()
                 if user_row is None:
                     raise WeightLogError(f'User {username} not found')
                 user_id = user_row.id
 
-                # Delete entries for this user.
-                rows = session.query(WeightLogEntryRow).filter(WeightLogEntryRow.user_id == user_id)
-                for row in rows:
-                    session.delete(row)
-
-                # Delete user row.
-                session.delete(user_row)
+                # Delete the user's entries and the user row with two bulk
+                # DELETEs, instead of loading every entry and deleting the
+                # rows one by one.
+                session.execute(
+                    delete(WeightLogEntryRow).where(WeightLogEntryRow.user_id == user_id))
+                session.execute(delete(UserRow).where(UserRow.id == user_id))
         except SQLAlchemyError as ex:
             raise WeightLogError(f'Unable to delete user: {ex}') from ex
 
@@ -205,7 +317,7 @@ class UserManager():
         try:
             with self.database.Session.begin() as session:
                 # Find user.
-                row = session.query(UserRow).filter(UserRow.id == user_id).first()
+                row = session.get(UserRow, user_id)
                 if row is None:
                     raise WeightLogError(f'User ID {user_id} not found')
 
@@ -214,29 +326,29 @@ class UserManager():
         except SQLAlchemyError as ex:
             raise WeightLogError(f'Unable to change password: {ex}') from ex
 
+        # Drop cached verifications for the old password.
+        with self.password_verify_cache_lock:
+            self.password_verify_cache.clear()
+
     def update_user(self, authenticated_user_id: int, updated_user: User) -> User:
         """ Update user (username, metric, and goal_weight). """
         try:
             with self.database.Session.begin() as session:
                 # Find user.
-                row = session.query(UserRow).filter(UserRow.id == authenticated_user_id).first()
+                row = session.get(UserRow, authenticated_user_id)
                 if row is None:
                     raise WeightLogError(f'User ID {authenticated_user_id} not found')
 
-                # Update username.
+                # Update username. The unique constraint on the column
+                # enforces uniqueness; a duplicate surfaces as an
+                # IntegrityError on commit, with no race window.
                 new_username: str = updated_user.username
                 if len(new_username) > 0 and new_username != row.username:
-                    # Make sure username is not already in use.
-                    if not self.get_user_from_username(new_username) is None:
-                        raise WeightLogError(
-                            f'Username {new_username} is already in use.',
-                            status = HTTPStatus.BAD_REQUEST)
-
                     row.username = new_username
 
                 # Update metric.
                 row.metric = updated_user.metric
-                updated_user.determine_units_name()
+                updated_user.units_name = UNITS_NAMES[updated_user.metric]
 
                 # Round goal weight to nearest tenth.
                 updated_user.goal_weight = round(updated_user.goal_weight, 1)
@@ -244,6 +356,10 @@ class UserManager():
                 # Update goal weight.
                 row.goal_weight = updated_user.goal_weight
 
+        except IntegrityError as ex:
+            raise WeightLogError(
+                f'Username {updated_user.username} is already in use.',
+                status = HTTPStatus.BAD_REQUEST) from ex
         except SQLAlchemyError as ex:
             raise WeightLogError(f'Unable to update user: {ex}') from ex
 
@@ -252,9 +368,12 @@ class UserManager():
     def get_user_from_username(self, username: str) -> User | None:
         """ Returns specified user. """
         try:
-            with self.database.Session.begin() as session:
+            # A plain session is enough for a read-only lookup; this runs on
+            # every login.
+            with self.database.Session() as session:
                 # Find user row.
-                row = session.query(UserRow).filter(UserRow.username == username).first()
+                row = session.execute(
+                    SELECT_USER_BY_USERNAME, {"username": username}).scalar_one_or_none()
                 if row is None:
                     return None # User not found.
 
@@ -267,9 +386,11 @@ class UserManager():
         """ Returns specified user. """
 
         try:
-            with self.database.Session.begin() as session:
+            # A plain session is enough for a read-only lookup, and
+            # session.get is the primary-key fast path.
+            with self.database.Session() as session:
                 # Find user row.
-                row = session.query(UserRow).filter(UserRow.id == user_id).first()
+                row = session.get(UserRow, user_id)
                 if row is None:
                     return None # User not found.
 
@@ -282,14 +403,23 @@ class UserManager():
         """ Returns all users. """
 
         try:
-            with self.database.Session.begin() as session:
-                # Find user rows.
-                rows = session.query(UserRow)
-                if rows is None:
-                    raise WeightLogError('No users not found')
-
-                # Return users
-                return [create_user_from_row(row) for row in rows]
+            # Read just the columns through Core, skipping per-row ORM
+            # instances, and build users with model_construct, which skips
+            # validation; rows from our own database are trusted.
+            with self.database.Session() as session:
+                rows = session.execute(select(
+                    UserRow.id, UserRow.username, UserRow.metric,
+                    UserRow.goal_weight, UserRow.password)).all()
+
+            return [
+                User.model_construct(
+                    id = row.id,
+                    username = row.username,
+                    metric = row.metric,
+                    units_name = UNITS_NAMES[row.metric],
+                    goal_weight = row.goal_weight,
+                    password = row.password)
+                for row in rows]
         except SQLAlchemyError as ex:
             raise WeightLogError(f'Unable to retrieve users: {ex}') from ex
 
@@ -302,7 +432,29 @@ class UserManager():
 
     def authenticate_user(self, user: User, password: str) -> bool:
         """ Authenticate user. """
-        return self.crypt_context.verify(password, user.password)
+
+        # Was this same password verified recently?
+        key: Tuple[int, bytes] = (user.id, hashlib.sha256(password.encode('utf-8')).digest())
+        now: float = time.monotonic()
+        with self.password_verify_cache_lock:
+            expiration = self.password_verify_cache.get(key)
+            if not expiration is None and now < expiration:
+                return True
+
+        # Verify password with the Argon2 hasher directly; the hash itself
+        # stays intentionally expensive.
+        try:
+            PASSWORD_HASHER.verify(user.password, password)
+        except (Argon2Error, InvalidHash):
+            return False
+
+        # Cache the successful verification. Only successes are cached, so a
+        # failed attempt is always re-verified.
+        with self.password_verify_cache_lock:
+            if len(self.password_verify_cache) >= PASSWORD_VERIFY_CACHE_MAX_SIZE:
+                self.password_verify_cache.clear()
+            self.password_verify_cache[key] = now + PASSWORD_VERIFY_CACHE_TTL
+        return True
 
     def create_access_token(self, username: str, password: str) -> Token:
         """ Create access token for user authentication. """
@@ -317,17 +469,30 @@ class UserManager():
             raise UserManager.create_credentials_error()
 
         # Create access token.
-        expires = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-        data = { "sub": str(user.id), "exp": expires }
-        data_encoded = jwt.encode(data, self.token_key, algorithm=ACCESS_TOKEN_ENCODE_ALGORITHM)
+        expiration: int = int(time.time()) + ACCESS_TOKEN_EXPIRE_HOURS * 3600
+        data = { "sub": str(user.id), "exp": expiration }
+        data_encoded = encode_hs256_token(data, self.token_key_bytes)
         return Token(token=data_encoded)
 
-    def get_user_from_token(self, token: str) -> User:
-        """ Looks up user from authentication token passed in from client. """
+    def decode_token(self, token: str) -> int:
+        """ Decode token and return the user id it holds. """
+
+        # Was this same token decoded recently? Claims can't change until the
+        # token expires, so a cached decode is good until then.
+        key: bytes = hashlib.sha256(token.encode('utf-8')).digest()
+        with self.token_decode_cache_lock:
+            cached = self.token_decode_cache.get(key)
+        if not cached is None:
+            if time.time() < cached[0]:
+                return cached[1]
+            with self.token_decode_cache_lock:
+                self.token_decode_cache.pop(key, None)
+            logging.info("Token has expired")
+            raise UserManager.create_credentials_error()
 
         # Decode token
         try:
-            payload = jwt.decode(token, self.token_key, algorithms=[ACCESS_TOKEN_ENCODE_ALGORITHM])
+            payload = decode_hs256_token(token, self.token_key_bytes)
         except ExpiredSignatureError as ex:
             logging.info("Token has expired")
             raise UserManager.create_credentials_error() from ex
@@ -336,7 +501,7 @@ class UserManager():
             raise UserManager.create_credentials_error() from ex
 
         # Get user id string from token
-        user_id_str: str = payload.get("sub")
+        user_id_str: str | None = payload.get("sub")
         if user_id_str is None:
             logging.warning("Key sub not found in token %s", str(payload))
             raise UserManager.create_credentials_error()
@@ -348,10 +513,26 @@ class UserManager():
             logging.warning("Failed to parse user id %s in token %s", user_id_str, str(payload))
             raise UserManager.create_credentials_error() from ex
 
+        # Cache the decode until the token expires.
+        expiration = payload.get("exp")
+        if not expiration is None:
+            with self.token_decode_cache_lock:
+                if len(self.token_decode_cache) >= TOKEN_DECODE_CACHE_MAX_SIZE:
+                    self.token_decode_cache.clear()
+                self.token_decode_cache[key] = (float(expiration), user_id)
+
+        return user_id
+
+    def get_user_from_token(self, token: str) -> User:
+        """ Looks up user from authentication token passed in from client. """
+
+        # Decode token.
+        user_id: int = self.decode_token(token)
+
         # Lookup user.
         user: User | None = self.get_user_from_id(user_id)
         if user is None:
-            logging.warning("User %s not found for token %s", user_id, str(payload))
+            logging.warning("User %s not found for token", user_id)
             raise UserManager.create_credentials_error()
 
         return user
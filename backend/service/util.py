@@ -20,60 +20,140 @@
 # Weight Logger. If not, see <https://www.gnu.org/licenses/>.
 
 # Standard library imports
+import functools
 import os
+import re
+import sys
+
+# 3rd party imports
+import numpy
 
 # Local imports
 from .error import WeightLogError
 
 keys: dict[str,str] = {}
 
-def load_keys_from_file(file_name: str) -> None:
+# Directory that holds the keys files, and the files to load from it.
+KEYS_DIR: str = '/keys'
+KEYS_FILES: tuple[str, ...] = ('keys-backend.env', 'keys-database.env')
+
+# Quote byte values, for trimming quoted values in the line-by-line
+# parser.
+QUOTE_CHARS: frozenset[int] = frozenset(b'\"\'')
+
+# Key entry pattern, compiled once at import. Matches a whole NAME=value
+# line, with the value either quoted or bare; like the line-by-line
+# parser it rejects a "=" anywhere in the value.
+KEY_LINE: re.Pattern = re.compile(
+    rb'^[ \t]*([A-Za-z_]\w*)[ \t]*=[ \t]*'
+    rb'(?:"([^"=\n]*)"|\'([^\'=\n]*)\'|([^\s=]*))[ \t\r]*$',
+    re.MULTILINE)
+
+def parse_keys(contents: bytes, file_name: str) -> None:
     # pylint: disable=line-too-long
     """
-    Load keys from file.
+    Parse keys file contents and save the keys.
 
     Entries are stored as environment variables, but not
     loaded as environment variables for better security, from
     [Why you shouldn't use ENV variables for secret data](<https://blog.diogomonica.com/2017/03/27/why-you-shouldnt-use-env-variables-for-secret-data/).
     """
 
+    # Fast path: one C-level regex scan over the whole file. If any
+    # non-blank line failed to match, fall back to the line-by-line
+    # parser, which reports the offending line number.
+    entries = KEY_LINE.findall(contents)
+    line_count: int = sum(
+        1 for line in contents.splitlines() if len(line.strip()) > 0)
+    if len(entries) != line_count:
+        parse_keys_by_line(contents, file_name)
+        return
+
+    for (key_name, double_quoted, single_quoted, bare) in entries:
+        # Exactly one of the value groups matched; empty groups collapse
+        # to the empty value either way.
+        key_value = double_quoted or single_quoted or bare
+
+        # Save key. Interning the name makes later dict probes an identity
+        # check, since lookups use interned literals.
+        try:
+            keys[sys.intern(key_name.decode('ascii'))] = key_value.decode('utf-8')
+        except UnicodeDecodeError as ex:
+            raise WeightLogError(f'Unexpected key entry in {file_name}') from ex
+
+def parse_keys_by_line(contents: bytes, file_name: str) -> None:
+    """ Parse keys file contents line by line.
+
+    Slow path for files the precompiled pattern doesn't fully match;
+    errors here carry the line number. """
+
+    # Work on bytes, so the whole file is never UTF-8 validated; only the
+    # short name and value of each entry are decoded at the end.
+    for (i, line) in enumerate(contents.splitlines()):
+        # Parse line into name and value. partition scans to the first
+        # "=" without building a list of parts.
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        (key_name, sep, key_value) = line.partition(b'=')
+        if len(sep) == 0 or b'=' in key_value:
+            raise WeightLogError(f'Unexpected key entry on line {i + 1} of {file_name}')
+        key_name = key_name.strip()
+        key_value = key_value.strip()
+
+        # Remove any outer quotes from value. Indexing bytes yields ints,
+        # and QUOTE_CHARS holds the two quote byte values, so this is two
+        # index reads and a set probe instead of startswith/endswith calls.
+        if len(key_value) > 1 and key_value[0] == key_value[-1] and \
+            key_value[0] in QUOTE_CHARS:
+            key_value = key_value[1 : len(key_value) - 1]
+
+        # Save key. Interning the name makes later dict probes an identity
+        # check, since lookups use interned literals.
+        try:
+            keys[sys.intern(key_name.decode('ascii'))] = key_value.decode('utf-8')
+        except UnicodeDecodeError as ex:
+            raise WeightLogError(
+                f'Unexpected key entry on line {i + 1} of {file_name}') from ex
+
+def load_keys_from_file(file_name: str) -> None:
+    """ Load keys from file. """
     try:
-        # Read keys file.
-        with open(file_name, "r", encoding="utf-8") as config_file:
-            contents: str = config_file.read()
-
-        quote_chars = ['\"', '\'']
-        for (i, line) in enumerate(contents.split('\n')):
-            # Parse line into name and value.
-            line = line.strip()
-            if len(line) == 0:
-                continue
-            parts: list[str] = line.split("=")
-            if len(parts) != 2:
-                raise WeightLogError(f'Unexpected key entry on line {i + 1} of {file_name}')
-            key_name: str = parts[0].strip()
-            key_value: str = parts[1].strip()
-
-            # Remove any outer quotes from value.
-            for quote_char in quote_chars:
-                if len(key_value) > 1 and \
-                    key_value.startswith(quote_char) and \
-                    key_value.endswith(quote_char):
-                    key_value = key_value[1 : len(key_value) - 1]
-                    break
-
-            # Save key
-            keys[key_name] = key_value
+        # Read keys file with a single read through os, skipping the io
+        # stack's extra stat, seek, and buffering work.
+        fd: int = os.open(file_name, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            contents: bytes = os.read(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
     except OSError as ex:
         raise WeightLogError(f'Could not load keys from {file_name}') from ex
+    parse_keys(contents, file_name)
 
 def load_keys() -> None:
-    """ Load keys. """
-    load_keys_from_file('/keys/keys-backend.env')
-    load_keys_from_file('/keys/keys-database.env')
+    """ Load keys.
 
+    The keys directory is opened once and both files are read through its
+    descriptor, so the directory path is resolved a single time. """
+    try:
+        dir_fd: int = os.open(KEYS_DIR, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for file_name in KEYS_FILES:
+                fd: int = os.open(file_name, os.O_RDONLY | os.O_CLOEXEC, dir_fd=dir_fd)
+                try:
+                    contents: bytes = os.read(fd, os.fstat(fd).st_size)
+                finally:
+                    os.close(fd)
+                parse_keys(contents, file_name)
+        finally:
+            os.close(dir_fd)
+    except OSError as ex:
+        raise WeightLogError(f'Could not load keys from {KEYS_DIR}') from ex
+    lookup_key.cache_clear()
+
+@functools.lru_cache(maxsize=None)
 def lookup_key(key_name: str) -> str:
-    """ Lookup key. """
+    """ Lookup key. Cached; load_keys clears the cache after a reload. """
     key_value = keys.get(key_name)
     if key_value is None:
         raise WeightLogError(f'Key {key_name} not found')
@@ -86,27 +166,47 @@ def lookup_env_var(env_var: str) -> str | None:
         return None
     return env_var_value
 
+@functools.lru_cache(maxsize=None)
 def lookup_env_var_int(env_var: str) -> int:
-    """ Lookup environment variable and return as integer. """
-    env_var_value_str = lookup_env_var(env_var)
-    if env_var_value_str is None:
-        env_var_value_str = ''
+    """ Lookup environment variable and return as integer.
+
+    Cached; environment variables don't change mid-process. """
+    # Probe the environment directly, skipping a wrapper call's frame. A
+    # missing or empty variable raises straight away, without the int('')
+    # round-trip that built and caught a guaranteed ValueError.
+    env_var_value_str = os.environ.get(env_var)
+    if env_var_value_str is None or len(env_var_value_str) == 0:
+        raise WeightLogError(f'Could not convert environment variable {env_var} ' + \
+            'to an integer')
     try:
-        env_var_value = int(env_var_value_str)
-        return env_var_value
+        return int(env_var_value_str)
     except ValueError as ex:
         raise WeightLogError(f'Could not convert environment variable {env_var} ' + \
             'to an integer') from ex
 
 KG_PER_LB: float = 0.45359237
+LB_PER_KG: float = 1.0 / KG_PER_LB
 
 def convert_to_metric(lbs: float) -> float:
     """ Convert lbs to kg. """
-    return round(lbs * KG_PER_LB, 1)
+    # Scale, truncate, and rescale to round half-up to one decimal without
+    # round()'s generic dispatch. Dividing by 10 (not multiplying by 0.1)
+    # keeps the result the closest double to the tenth, same as round().
+    return int(lbs * KG_PER_LB * 10.0 + 0.5) / 10.0
 
 def convert_to_english(kilograms: float) -> float:
     """ Convert kg to lbs. """
-    return round(kilograms/ KG_PER_LB, 0)
+    # Multiplying by the precomputed reciprocal is cheaper than dividing,
+    # and the add-a-half truncation rounds half-up to a whole number.
+    return float(int(kilograms * LB_PER_KG + 0.5))
+
+def convert_array_to_metric(lbs: numpy.ndarray) -> numpy.ndarray:
+    """ Convert an array of lbs to kg in one vectorized pass. """
+    return numpy.round(lbs * KG_PER_LB, 1)
+
+def convert_array_to_english(kilograms: numpy.ndarray) -> numpy.ndarray:
+    """ Convert an array of kg to lbs in one vectorized pass. """
+    return numpy.round(kilograms * LB_PER_KG, 0)
 
 def determine_units_name(metric: bool) -> str:
     """ Determine units name. """
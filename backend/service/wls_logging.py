@@ -30,6 +30,21 @@ from loguru import logger
 LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "DEBUG"))
 JSON_LOGS = os.environ.get("JSON_LOGS", "0") == "1"
 
+# Loguru levels by stdlib level name, baked at import for the standard
+# names; looked up for every intercepted record.
+LEVEL_CACHE: dict[str, str | int] = {}
+for level_name in ('TRACE', 'DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR', 'CRITICAL'):
+    try:
+        LEVEL_CACHE[level_name] = logger.level(level_name).name
+    except ValueError:
+        pass
+
+# The logging module's filename, hoisted and interned so the per-record
+# frame walk compares against one cached string. Interning keeps the
+# equality check a pointer compare whenever co_filename is the same
+# object, with full comparison as the safe fallback.
+LOGGING_FILE: str = sys.intern(logging.__file__)
+
 class InterceptHandler(logging.Handler):
     """
     Intercept standard logging messages and send to Loguru sink.
@@ -37,19 +52,21 @@ class InterceptHandler(logging.Handler):
     """
 
     def emit(self, record):
-        # Get corresponding Loguru level if it exists
-        try:
-            level = logger.level(record.levelname).name
-        except ValueError:
-            level = record.levelno
+        # Get corresponding Loguru level if it exists. The map was baked at
+        # import, so this is one dict get with no try/except; names loguru
+        # doesn't know fall back to the record's levelno.
+        level = LEVEL_CACHE.get(record.levelname, record.levelno)
 
         # Find caller that generated logged message
         frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:
+        while not frame is None and frame.f_code.co_filename == LOGGING_FILE:
             frame = frame.f_back
             depth += 1
 
-        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+        # Pass getMessage as a callable with lazy=True, so the msg % args
+        # formatting only runs if a sink actually consumes the record.
+        logger.opt(depth=depth, exception=record.exc_info, lazy=True).log(
+            level, "{}", record.getMessage)
 
 def setup_loguru():
     # pylint: disable=line-too-long
@@ -65,12 +82,22 @@ def setup_loguru():
     logging.root.setLevel(LOG_LEVEL)
 
     # Remove every other logger's handlers # and propagate to root logger.
+    # Iterating the values directly skips two getLogger lookups per name,
+    # and leaves PlaceHolder entries alone instead of forcing them into
+    # real loggers.
     # pylint error: "Instance of 'RootLogger' has no 'loggerDict' member (no-member)"
     # pylint: disable=no-member
-    # pylint: disable=consider-iterating-dictionary
-    for name in logging.root.manager.loggerDict.keys():
-        logging.getLogger(name).handlers = []
-        logging.getLogger(name).propagate = True
+    for existing_logger in logging.root.manager.loggerDict.values():
+        if isinstance(existing_logger, logging.Logger):
+            existing_logger.handlers = []
+            existing_logger.propagate = True
 
-    # Configure loguru.
-    logger.configure(handlers=[{"sink": sys.stdout, "serialize": JSON_LOGS}])
+    # Configure loguru. enqueue moves sink I/O to a background thread so log
+    # calls never block request handlers, and backtrace/diagnose are disabled
+    # to skip building expensive exception detail.
+    logger.configure(handlers=[{
+        "sink": sys.stdout,
+        "serialize": JSON_LOGS,
+        "enqueue": True,
+        "backtrace": False,
+        "diagnose": False}])
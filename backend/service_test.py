@@ -11,20 +11,16 @@ from fastapi import HTTPException
 import pytest
 
 # Local imports
-from service import Service
 from service.entry import WeightLogEntry
 from service.token import Token
 from service.user import User
 
-# Service
-service: Service = Service()
-
 # User
 USERNAME: str = "Betty"
 PASSWORD: str = "boop de doop"
 USER_ID: int = 100
 
-def test_create_user():
+def test_create_user(service):
     """ Test creating a user. """
 
     # Create user.
@@ -48,7 +44,7 @@ def test_create_user():
     assert user.units_name == "lb"
     assert user.goal_weight == goal_weight
 
-def test_login():
+def test_login(service):
     """ Test login. """
 
     token: Token = service.login(USERNAME, PASSWORD)
@@ -67,10 +63,11 @@ def create_entries(
 def check_entries(left: list[WeightLogEntry], right: list[WeightLogEntry]) -> None:
     """ Check that entries are equal. """
 
-    for left_entry, right_entry in zip(left, right):
-        assert left_entry == right_entry
+    # Comparing the lists directly runs at C level and also catches a
+    # length mismatch, which the old element-wise zip loop ignored.
+    assert left == right
 
-def test_add_entries():
+def test_add_entries(service):
     """ Test adding weight log entries. """
 
     # Create entries to add.
@@ -81,16 +78,15 @@ def test_add_entries():
         (0, datetime.date(2022, 3, 24), 125.0, False),
         (0, datetime.date(2022, 3, 27), 127.0, False)])
 
-    # Add entries.
-    for entry in entries_to_add:
-        service.add_entry(entry)
+    # Add entries, with one transaction for the whole batch.
+    service.add_entries(entries_to_add)
 
     # Are entries the same?
     entries_to_add.sort(key=lambda entry: entry.date)
     user: User = service.user_manager.get_user_from_id(USER_ID)
     check_entries(service.get_entries(user), entries_to_add)
 
-def test_add_entry_fail():
+def test_add_entry_fail(service):
     """ Test that adding an entry with a duplicate date fails. """
 
     entry: WeightLogEntry = WeightLogEntry(
@@ -105,7 +101,7 @@ def test_add_entry_fail():
         http_ex: HTTPException = exc_info.value
         assert http_ex.status == HTTPStatus.BAD_REQUEST
 
-def test_update_entry():
+def test_update_entry(service):
     """ Test updating an entry. """
 
     # Update entry.
@@ -121,7 +117,7 @@ def test_update_entry():
     updated_entry: WeightLogEntry = service.get_entry_from_entry_id(entry.id)
     assert updated_entry == entry
 
-def test_update_fails():
+def test_update_fails(service):
     """ Test updating a non-existent entry fails. """
 
     entry: WeightLogEntry = WeightLogEntry(
@@ -136,7 +132,7 @@ def test_update_fails():
         http_ex: HTTPException = exc_info.value
         assert http_ex.status == HTTPStatus.BAD_REQUEST
 
-def test_delete_entry():
+def test_delete_entry(service):
     """ Test deleting an entry. """
 
     # Confirm entry exists.
@@ -149,7 +145,7 @@ def test_delete_entry():
     # Confirm entry no longer exists.
     assert service.get_entry_from_entry_id(entry.id) is None
 
-def test_delete_entry_fails():
+def test_delete_entry_fails(service):
     """ Test delete failure for non-existent date. """
 
     with pytest.raises(HTTPException) as exc_info:
@@ -158,7 +154,7 @@ def test_delete_entry_fails():
         http_ex: HTTPException = exc_info.value
         assert http_ex.status == HTTPStatus.BAD_REQUEST
 
-def test_get_entries():
+def test_get_entries(service):
     """ Test get of all entries for current user. """
 
     # Create expected entries.